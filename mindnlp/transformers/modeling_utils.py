@@ -290,6 +290,9 @@ class PreTrainedModel(nn.Cell, CellUtilMixin, GenerationMixin):
     # warnings.
     _keys_to_ignore_on_load_unexpected = None
     _keys_to_ignore_on_save = None
+    # a list of `re` patterns of checkpoint keys that `_load_from_state_dict` only rewrites together with other keys.
+    # When such keys are left over in one shard of a sharded checkpoint, they are carried over to the next shard.
+    _keys_to_group_on_load = None
 
     _tied_weights_keys = None
 
@@ -369,6 +372,22 @@ class PreTrainedModel(nn.Cell, CellUtilMixin, GenerationMixin):
 
         self.base_model._prune_heads(heads_to_prune)
 
+    @classmethod
+    def _load_from_state_dict(cls, state_dict):
+        """
+        Rewrite a loaded checkpoint `state_dict` before it is matched against the model parameters. Derived classes
+        can override this to adapt checkpoints whose parameter layout differs from the model.
+        """
+        return state_dict
+
+    @classmethod
+    def _save_to_state_dict(cls, state_dict):
+        """
+        Rewrite the `state_dict` of the model before it is saved, the inverse of `_load_from_state_dict`. Derived
+        classes overriding one of them should override both, so that saved checkpoints keep the original layout.
+        """
+        return state_dict
+
     def _init_weights(self, cell):
         """
         Initialize the weights. This method should be overridden by derived class and is
@@ -1028,7 +1047,7 @@ class PreTrainedModel(nn.Cell, CellUtilMixin, GenerationMixin):
 
         if is_sharded:
             # rsolved_archive_file becomes a list of files that point to the different checkpoint shards in this case.
-            resolved_archive_file, sharded_metadata = get_checkpoint_shard_files(
+            resolved_archive_file, _ = get_checkpoint_shard_files(
                 pretrained_model_name_or_path,
                 resolved_archive_file,
                 cache_dir=cache_dir,
@@ -1217,18 +1236,27 @@ class PreTrainedModel(nn.Cell, CellUtilMixin, GenerationMixin):
         if state_dict is None:
             if is_sharded:
                 all_keys_unexpected = []
+                loaded_keys = []
+                carried_state_dict = {}
                 for name in tqdm(converted_filenames, desc="Loading checkpoint shards"):
-                    state_dict = load_ckpt(name, from_pt)
+                    state_dict = cls._load_from_state_dict({**carried_state_dict, **load_ckpt(name, from_pt)})
+                    # keys of groups that are split across shards wait for the rest of their group
+                    carried_state_dict = {
+                        k: state_dict.pop(k) for k in list(state_dict)
+                        if any(re.search(pat, k) for pat in cls._keys_to_group_on_load or [])
+                    }
+                    loaded_keys.extend(state_dict.keys())
                     keys_unexpected, keys_missing = load_param_into_net(model, state_dict, cls.base_model_prefix)
                     all_keys_unexpected.extend(keys_unexpected)
                     del state_dict
                     gc.collect()
-                loaded_keys = sharded_metadata["all_checkpoint_keys"]
+                all_keys_unexpected.extend(carried_state_dict.keys())
             else:
-                state_dict = load_ckpt(resolved_archive_file, from_pt)
+                state_dict = cls._load_from_state_dict(load_ckpt(resolved_archive_file, from_pt))
                 loaded_keys = list(state_dict.keys())
                 all_keys_unexpected, keys_missing = load_param_into_net(model, state_dict, cls.base_model_prefix)
         else:
+            state_dict = cls._load_from_state_dict(state_dict)
             loaded_keys = list(state_dict.keys())
             all_keys_unexpected, keys_missing = load_param_into_net(model, state_dict, cls.base_model_prefix)
 
@@ -1325,7 +1353,7 @@ class PreTrainedModel(nn.Cell, CellUtilMixin, GenerationMixin):
 
         # If we save using the predefined names, we can load using `from_pretrained`
         output_model_file = os.path.join(save_dir, WEIGHTS_NAME)
-        save_checkpoint(model_to_save, output_model_file)
+        save_checkpoint(model_to_save._save_to_state_dict(model_to_save.parameters_dict()), output_model_file)
 
         logger.info(f"Model weights saved in {output_model_file}")
 
@@ -1510,6 +1538,7 @@ class PreTrainedModel(nn.Cell, CellUtilMixin, GenerationMixin):
         # Save the model
         if state_dict is None:
             state_dict = model_to_save.parameters_dict()
+        state_dict = model_to_save._save_to_state_dict(state_dict)
 
         # Handle the case where some state_dict keys shouldn't be saved
         if self._keys_to_ignore_on_save is not None:
@@ -129,6 +129,17 @@ class XLMConfig(PretrainedConfig):
             Model agnostic parameter to identify masked tokens when generating text in an MLM context.
         lang_id (`int`, *optional*, defaults to 1):
             The ID of the language used by the model. This parameter is used when generating text in a given language.
+        use_flash_attention (`bool`, *optional*, defaults to `False`):
+            Whether to compute attention block by block with an online softmax instead of materializing the full score
+            matrix. Only used for sequences longer than one block, when attention weights, head masks and attention
+            dropout are not needed.
+        attention_top_k (`int`, *optional*):
+            If set, every query of a long sequence only attends to its `attention_top_k` highest scoring keys. Short
+            sequences and calls that return attention weights keep the dense softmax.
+        attention_dtype (`str`, *optional*):
+            Reduced precision dtype (`"float16"` or `"bfloat16"`) used for the attention matmuls and the key/value
+            cache in every attention path (dense, tiled and top-k). The softmax is always computed in float32. Defaults
+            to the dtype of the model.
 
     Examples:
 
@@ -186,6 +197,9 @@ class XLMConfig(PretrainedConfig):
         end_n_top=5,
         mask_token_id=0,
         lang_id=0,
+        use_flash_attention=False,
+        attention_top_k=None,
+        attention_dtype=None,
         pad_token_id=2,
         bos_token_id=0,
         **kwargs,
@@ -222,6 +236,11 @@ class XLMConfig(PretrainedConfig):
         self.end_n_top = end_n_top
         self.mask_token_id = mask_token_id
         self.lang_id = lang_id
+        self.use_flash_attention = use_flash_attention
+        self.attention_top_k = attention_top_k
+        if attention_dtype not in (None, "float16", "bfloat16"):
+            raise ValueError(f"`attention_dtype` must be None, 'float16' or 'bfloat16', got {attention_dtype!r}.")
+        self.attention_dtype = attention_dtype
 
         if "n_words" in kwargs:
             self.n_words = kwargs["n_words"]
@@ -23,15 +23,17 @@
 import itertools
 import math
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Dict, Optional, Tuple, Union
 
 import numpy as np
 import mindspore
-from mindspore import nn, ops, Tensor
+from mindspore import nn, ops, Tensor, Parameter
 from mindspore.common.initializer import initializer, Normal
 
 from mindnlp.utils import (
     ModelOutput,
+    is_numba_available,
     logging,
 )
 from .configuration_xlm import XLMConfig
@@ -44,12 +46,34 @@ from ...modeling_outputs import (
     TokenClassifierOutput,
 )
 from ...modeling_utils import PreTrainedModel, SequenceSummary, SQuADHead
-from ...ms_utils import apply_chunking_to_forward, find_pruneable_heads_and_indices, prune_linear_layer
+from ...ms_utils import find_pruneable_heads_and_indices, prune_linear_layer
 
 
 logger = logging.get_logger(__name__)
 
 
+@lru_cache(maxsize=None)
+def _numba_sincos_pe():
+    """Compile the numba sinusoidal table kernel on first use, so that importing the model does not import numba."""
+    import numba  # pylint: disable=import-outside-toplevel
+
+    # no fastmath: the table must not depend on whether numba is installed
+    @numba.njit(parallel=True)
+    def _sincos_pe(div_term, out):
+        for p in numba.prange(out.shape[0]):
+            for i in range(div_term.shape[0]):
+                a = p * div_term[i]
+                out[p, 2 * i] = math.sin(a)
+                if 2 * i + 1 < out.shape[1]:
+                    out[p, 2 * i + 1] = math.cos(a)
+
+    return _sincos_pe
+
+
+# below this many table entries the numba compilation costs more than it saves
+_NUMBA_MIN_PE_SIZE = 1 << 22
+
+
 XLM_PRETRAINED_MODEL_ARCHIVE_LIST = [
     "xlm-mlm-en-2048",
     "xlm-mlm-ende-1024",
@@ -66,9 +90,16 @@ XLM_PRETRAINED_MODEL_ARCHIVE_LIST = [
 
 
 def create_sinusoidal_embeddings(n_pos, dim, out):
-    position_enc = np.array([[pos / np.power(10000, 2 * (j // 2) / dim) for j in range(dim)] for pos in range(n_pos)])
-    out[:, 0::2] = mindspore.Tensor(np.sin(position_enc[:, 0::2]))
-    out[:, 1::2] = mindspore.Tensor(np.cos(position_enc[:, 1::2]))
+    # angles are computed in float64 by both paths and only rounded to float32 when stored
+    out_np = np.empty((n_pos, dim), dtype=np.float32)
+    div_term = np.exp(np.arange(0, dim, 2, dtype=np.float64) * (-math.log(10000.0) / dim))
+    if n_pos * dim >= _NUMBA_MIN_PE_SIZE and is_numba_available():
+        _numba_sincos_pe()(div_term, out_np)
+    else:
+        angles = np.arange(n_pos, dtype=np.float64)[:, None] * div_term  # (n_pos, ceil(dim / 2))
+        out_np[:, 0::2] = np.sin(angles)
+        out_np[:, 1::2] = np.cos(angles[:, : dim // 2])
+    out.set_data(mindspore.Tensor(out_np, out.dtype))
 
 
 def get_masks(slen, lengths, causal, padding_mask=None):
@@ -83,21 +114,94 @@ def get_masks(slen, lengths, causal, padding_mask=None):
         mask = alen < lengths[:, None]
 
     # attention mask is the same as mask, or triangular inferior attention (causal)
+    # the causal mask is identical for every sample, so it is kept with a broadcastable batch dimension
     bs = lengths.shape[0]
     if causal:
-        attn_mask = alen[None, None, :].tile((bs, slen, 1)) <= alen[None, :, None]
+        attn_mask = (alen[None, :] <= alen[:, None]).view(1, slen, slen)
     else:
         attn_mask = mask
 
     # sanity check
     assert mask.shape == (bs, slen)
-    assert causal is False or attn_mask.shape == (bs, slen, slen)
+    assert causal is False or attn_mask.shape == (1, slen, slen)
 
     return mask, attn_mask
 
 
+def _flash_attention(q, k, v, mask_add, block_size=128):
+    """
+    Blockwise attention with an online softmax over key/value tiles, so that the full `(bs, n_heads, qlen, klen)`
+    score matrix is never materialized. `q` is expected to be already scaled and `mask_add` is the additive
+    `(bs, klen)` or `(1, qlen, klen)` mask built by `XLMModel`. The matmuls run in the dtype of `q`/`k`/`v`, the
+    softmax statistics and the output accumulator in float32.
+    """
+    bs, n_heads, qlen, _ = q.shape
+    klen = k.shape[2]
+    neg_inf = float(np.finfo(np.float32).min)
+
+    m_i = ops.full((bs, n_heads, qlen, 1), neg_inf, dtype=mindspore.float32)  # running row max
+    l_i = ops.zeros((bs, n_heads, qlen, 1), mindspore.float32)  # running sum of exp
+    o_i = ops.zeros((bs, n_heads, qlen, v.shape[-1]), mindspore.float32)
+    for start in range(0, klen, block_size):
+        end = min(start + block_size, klen)
+        k_j = k[:, :, start:end]
+        v_j = v[:, :, start:end]
+        if mask_add.dim() == 3:
+            mask_j = mask_add[:, None, :, start:end]
+        else:
+            mask_j = mask_add[:, None, None, start:end]
+
+        s_ij = ops.matmul(q, k_j.swapaxes(2, 3)).float() + mask_j  # (bs, n_heads, qlen, block_size)
+        m_new = ops.maximum(m_i, s_ij.max(axis=-1, keepdims=True))
+        alpha = ops.exp(m_i - m_new)
+        p_ij = ops.exp(s_ij - m_new)
+        l_i = alpha * l_i + p_ij.sum(axis=-1, keepdims=True)
+        o_i = alpha * o_i + ops.matmul(p_ij.astype(v_j.dtype), v_j).float()
+        m_i = m_new
+
+    return (o_i / l_i).astype(v.dtype)
+
+
+def _topk_attention(q, k, v, mask_add, top_k, chunk_size=128, dropout=0.0, training=False):
+    """
+    Attention restricted to the `top_k` highest scoring keys of every query. Queries are processed in chunks of
+    `chunk_size` so that only `(chunk_size, klen)` scores and `(chunk_size, top_k)` weights are alive at once. Inputs
+    follow the same conventions as `_flash_attention`.
+    """
+    bs, n_heads, qlen, dim_per_head = q.shape
+    klen = k.shape[2]
+    v_flat = v.reshape(bs * n_heads, klen, dim_per_head)
+    k_t = k.swapaxes(2, 3)  # (bs, n_heads, dim_per_head, klen), shared by all query chunks
+
+    contexts = []
+    for start in range(0, qlen, chunk_size):
+        end = min(start + chunk_size, qlen)
+        if mask_add.dim() == 3:
+            mask_c = mask_add[:, None, start:end]
+        else:
+            mask_c = mask_add[:, None, None, :]
+
+        # matmul in the operand dtype, selection and softmax in float32
+        scores = ops.matmul(q[:, :, start:end], k_t).float() + mask_c  # (bs, n_heads, c, klen)
+        top_vals, top_idx = ops.topk(scores, top_k, dim=-1)  # (bs, n_heads, c, top_k)
+        weights = ops.softmax(top_vals, axis=-1).astype(v.dtype)
+        weights = ops.dropout(weights, p=dropout, training=training)
+
+        # gather the selected values per (batch, head) instead of expanding v over the query axis
+        top_idx = top_idx.reshape(bs * n_heads, (end - start) * top_k)
+        v_sel = ops.gather(v_flat, top_idx, 1, batch_dims=1)  # (bs * n_heads, c * top_k, dim_per_head)
+        v_sel = v_sel.reshape(bs, n_heads, end - start, top_k, dim_per_head)
+        context = ops.matmul(weights.unsqueeze(-2), v_sel).squeeze(-2)  # (bs, n_heads, c, dim_per_head)
+        contexts.append(context)
+
+    return ops.cat(contexts, axis=2)
+
+
 class MultiHeadAttention(nn.Cell):
     NEW_ID = itertools.count()
+    FLASH_BLOCK_SIZE = 128
+    TOP_K_QUERY_CHUNK = 128
+    TOP_K_MIN_SCORES = 512 * 512  # below this many scores per head the dense softmax is cheaper
 
     def __init__(self, n_heads, dim, config):
         super().__init__()
@@ -105,35 +209,49 @@ class MultiHeadAttention(nn.Cell):
         self.dim = dim
         self.n_heads = n_heads
         self.dropout = config.attention_dropout
+        self.max_len = config.max_position_embeddings  # upper bound of the key/value cache length
+        self.top_k = config.attention_top_k
+        self.attention_dtype = getattr(mindspore, config.attention_dtype) if config.attention_dtype else None
         assert self.dim % self.n_heads == 0
 
-        self.q_lin = nn.Dense(dim, dim)
-        self.k_lin = nn.Dense(dim, dim)
-        self.v_lin = nn.Dense(dim, dim)
+        self.qkv_lin = nn.Dense(dim, 3 * dim)  # packed q/k/v projections
         self.out_lin = nn.Dense(dim, dim)
         self.pruned_heads = set()
+        self.use_flash_attention = config.use_flash_attention
 
     def prune_heads(self, heads):
         attention_head_size = self.dim // self.n_heads
         if len(heads) == 0:
             return
         heads, index = find_pruneable_heads_and_indices(heads, self.n_heads, attention_head_size, self.pruned_heads)
-        # Prune linear layers
-        self.q_lin = prune_linear_layer(self.q_lin, index)
-        self.k_lin = prune_linear_layer(self.k_lin, index)
-        self.v_lin = prune_linear_layer(self.v_lin, index)
+        # Prune linear layers, the packed projection holds q, k and v one after the other on the output axis
+        qkv_index = ops.cat([index, index + self.dim, index + 2 * self.dim])
+        self.qkv_lin = prune_linear_layer(self.qkv_lin, qkv_index)
         self.out_lin = prune_linear_layer(self.out_lin, index, axis=1)
         # Update hyper params
         self.n_heads = self.n_heads - len(heads)
         self.dim = attention_head_size * self.n_heads
         self.pruned_heads = self.pruned_heads.union(heads)
 
-    def construct(self, input, mask, kv=None, cache=None, head_mask=None, output_attentions=False):
+    def construct(self, input, mask_add, kv=None, cache=None, head_mask=None, output_attentions=False):
         """
         Self-attention (if kv is None) or attention over source sentence (provided by kv).
         """
+        if output_attentions:
+            return self._forward_attn_with_weights(input, mask_add, kv, cache, head_mask)
+        return (self._forward_attn_only(input, mask_add, kv, cache, head_mask),)
+
+    def _forward_attn_only(self, input, mask_add, kv=None, cache=None, head_mask=None):
+        """Attention output only, without building an output tuple."""
+        return self._attention(input, mask_add, kv, cache, head_mask, False)
+
+    def _forward_attn_with_weights(self, input, mask_add, kv=None, cache=None, head_mask=None):
+        """Attention output together with the attention weights."""
+        return self._attention(input, mask_add, kv, cache, head_mask, True)
+
+    def _attention(self, input, mask_add, kv, cache, head_mask, output_attentions):
         # Input is (bs, qlen, dim)
-        # Mask is (bs, klen) (non-causal) or (bs, klen, klen)
+        # Additive mask is (bs, klen) (non-causal) or (1, qlen, klen) (causal, broadcast over the batch)
         bs, qlen, _ = input.shape
         if kv is None:
             klen = qlen if cache is None else cache["slen"] + qlen
@@ -142,7 +260,6 @@ class MultiHeadAttention(nn.Cell):
         # assert dim == self.dim, f'Dimensions do not match: {dim} input vs {self.dim} configured'
         n_heads = self.n_heads
         dim_per_head = self.dim // n_heads
-        mask_reshape = (bs, 1, qlen, klen) if mask.dim() == 3 else (bs, 1, 1, klen)
 
         def shape(x):
             """projection"""
@@ -150,46 +267,100 @@ class MultiHeadAttention(nn.Cell):
 
         def unshape(x):
             """compute context"""
-            return x.swapaxes(1, 2).view(bs, -1, self.n_heads * dim_per_head)
+            x = x.swapaxes(1, 2).view(bs, -1, self.n_heads * dim_per_head)
+            return x if self.attention_dtype is None else x.astype(input.dtype)
 
-        q = shape(self.q_lin(input))  # (bs, n_heads, qlen, dim_per_head)
         if kv is None:
-            k = shape(self.k_lin(input))  # (bs, n_heads, qlen, dim_per_head)
-            v = shape(self.v_lin(input))  # (bs, n_heads, qlen, dim_per_head)
-        elif cache is None or self.layer_id not in cache:
-            k = v = kv
-            k = shape(self.k_lin(k))  # (bs, n_heads, qlen, dim_per_head)
-            v = shape(self.v_lin(v))  # (bs, n_heads, qlen, dim_per_head)
+            q, k, v = ops.split(self.qkv_lin(input), self.dim, axis=-1)
+            q = shape(q)  # (bs, n_heads, qlen, dim_per_head)
+            k = shape(k)  # (bs, n_heads, qlen, dim_per_head)
+            v = shape(v)  # (bs, n_heads, qlen, dim_per_head)
+        else:
+            q_w, k_w, v_w = ops.split(self.qkv_lin.weight, self.dim, axis=0)
+            q_b, k_b, v_b = ops.split(self.qkv_lin.bias, self.dim, axis=0)
+            q = shape(ops.dense(input, q_w, q_b))  # (bs, n_heads, qlen, dim_per_head)
+            if cache is None or self.layer_id not in cache:
+                k = shape(ops.dense(kv, k_w, k_b))  # (bs, n_heads, klen, dim_per_head)
+                v = shape(ops.dense(kv, v_w, v_b))  # (bs, n_heads, klen, dim_per_head)
+
+        if self.attention_dtype is not None:
+            # the attention matmuls run in reduced precision, which also halves the cached keys/values
+            q = q.astype(self.attention_dtype)
+            if kv is None or cache is None or self.layer_id not in cache:
+                k = k.astype(self.attention_dtype)
+                v = v.astype(self.attention_dtype)
 
         if cache is not None:
-            if self.layer_id in cache:
-                if kv is None:
-                    k_, v_ = cache[self.layer_id]
-                    k = ops.cat([k_, k], axis=2)  # (bs, n_heads, klen, dim_per_head)
-                    v = ops.cat([v_, v], axis=2)  # (bs, n_heads, klen, dim_per_head)
+            if kv is None:
+                # Self-attention cache entries are `(k_buf, v_buf, cur_len)`: keys/values are written into buffers of
+                # shape (bs, n_heads, capacity, dim_per_head) whose first `cur_len` positions are valid, instead of
+                # being re-concatenated at every step. Cross-attention entries stay `(k, v)`.
+                if self.layer_id in cache:
+                    k_buf, v_buf, cur_len = cache[self.layer_id]
                 else:
+                    k_buf, v_buf, cur_len = None, None, 0
+                if cur_len + qlen > self.max_len:
+                    raise ValueError(
+                        f"Cannot cache {cur_len + qlen} positions, the key/value cache holds at most "
+                        f"max_position_embeddings={self.max_len} positions."
+                    )
+                if k_buf is None or cur_len + qlen > k_buf.shape[2]:
+                    # the capacity doubles, so token by token decoding copies the cache a logarithmic number of times
+                    capacity = min(max(cur_len + qlen, 2 * cur_len), self.max_len)
+                    new_k_buf = ops.zeros((bs, n_heads, capacity, dim_per_head), k.dtype)
+                    new_v_buf = ops.zeros((bs, n_heads, capacity, dim_per_head), v.dtype)
+                    if cur_len > 0:
+                        new_k_buf[:, :, :cur_len] = k_buf[:, :, :cur_len]
+                        new_v_buf[:, :, :cur_len] = v_buf[:, :, :cur_len]
+                    k_buf, v_buf = new_k_buf, new_v_buf
+                k_buf[:, :, cur_len:cur_len + qlen] = k
+                v_buf[:, :, cur_len:cur_len + qlen] = v
+                cur_len += qlen
+                cache[self.layer_id] = (k_buf, v_buf, cur_len)
+                k = k_buf[:, :, :cur_len]  # (bs, n_heads, klen, dim_per_head)
+                v = v_buf[:, :, :cur_len]  # (bs, n_heads, klen, dim_per_head)
+            else:
+                if self.layer_id in cache:
                     k, v = cache[self.layer_id]
-            cache[self.layer_id] = (k, v)
+                cache[self.layer_id] = (k, v)
 
         q = q / math.sqrt(dim_per_head)  # (bs, n_heads, qlen, dim_per_head)
-        scores = ops.matmul(q, k.swapaxes(2, 3))  # (bs, n_heads, qlen, klen)
-        mask = (mask == 0).view(mask_reshape).expand_as(scores)  # (bs, n_heads, qlen, klen)
-        scores = scores.masked_fill(mask, np.finfo(mindspore.dtype_to_nptype(scores.dtype)).min)  # (bs, n_heads, qlen, klen)
+        # the sparse and tiled paths never build the full weights, so they cannot return them or apply a head mask
+        if not output_attentions and head_mask is None:
+            if self.top_k is not None and self.top_k < klen and qlen * klen >= self.TOP_K_MIN_SCORES:
+                context = _topk_attention(
+                    q, k, v, mask_add, self.top_k, self.TOP_K_QUERY_CHUNK, self.dropout, self.training
+                )  # (bs, n_heads, qlen, dim_per_head)
+                return self.out_lin(unshape(context))
+
+            # the tiled path has no attention dropout
+            if self.use_flash_attention and klen > self.FLASH_BLOCK_SIZE and (not self.training or self.dropout == 0):
+                context = _flash_attention(q, k, v, mask_add, self.FLASH_BLOCK_SIZE)  # (bs, n_heads, qlen, dim_per_head)
+                return self.out_lin(unshape(context))
 
-        weights = ops.softmax(scores.float(), axis=-1).astype(scores.dtype)  # (bs, n_heads, qlen, klen)
+        scores = ops.matmul(q, k.swapaxes(2, 3))  # (bs, n_heads, qlen, klen)
+        mask_add = mask_add[:, None] if mask_add.dim() == 3 else mask_add[:, None, None, :]  # (bs, 1, qlen, klen)
+        scores = scores + mask_add  # (bs, n_heads, qlen, klen)
+
+        # scores are normally float32 already (the additive mask is float32), only upcast when they are not
+        if scores.dtype != mindspore.float32:
+            scores = scores.float()
+        weights = ops.softmax(scores, axis=-1)  # (bs, n_heads, qlen, klen)
+        if weights.dtype != v.dtype:
+            weights = weights.astype(v.dtype)
         weights = ops.dropout(weights, p=self.dropout, training=self.training)  # (bs, n_heads, qlen, klen)
 
         # Mask heads if we want to
         if head_mask is not None:
-            weights = weights * head_mask
+            weights = weights * head_mask.astype(weights.dtype)
 
         context = ops.matmul(weights, v)  # (bs, n_heads, qlen, dim_per_head)
         context = unshape(context)  # (bs, qlen, dim)
 
-        outputs = (self.out_lin(context),)
+        output = self.out_lin(context)
         if output_attentions:
-            outputs = outputs + (weights,)
-        return outputs
+            return output, weights
+        return output
 
 
 class TransformerFFN(nn.Cell):
@@ -203,7 +374,20 @@ class TransformerFFN(nn.Cell):
         self.seq_len_dim = 1
 
     def construct(self, input):
-        return apply_chunking_to_forward(self.ff_chunk, self.chunk_size_feed_forward, self.seq_len_dim, input)
+        if self.chunk_size_feed_forward <= 0:
+            return self.ff_chunk(input)
+
+        # write every chunk into a preallocated output instead of concatenating a tuple of chunks
+        seq_len = input.shape[self.seq_len_dim]
+        output = None
+        for start in range(0, seq_len, self.chunk_size_feed_forward):
+            end = min(start + self.chunk_size_feed_forward, seq_len)
+            index = (slice(None),) * self.seq_len_dim + (slice(start, end),)  # start:end along seq_len_dim
+            chunk = self.ff_chunk(input[index])
+            if output is None:
+                output = ops.zeros(input.shape[:-1] + chunk.shape[-1:], chunk.dtype)
+            output[index] = chunk
+        return output
 
     def ff_chunk(self, input):
         x = self.lin1(input)
@@ -222,6 +406,8 @@ class XLMPreTrainedModel(PreTrainedModel):
     config_class = XLMConfig
     load_tf_weights = None
     base_model_prefix = "transformer"
+    # separate q/k/v projections are packed into `qkv_lin` on load, possibly from different shards
+    _keys_to_group_on_load = [r"(^|\.)[qkv]_lin\.(weight|bias)$"]
 
     @property
     def dummy_inputs(self):
@@ -233,6 +419,30 @@ class XLMPreTrainedModel(PreTrainedModel):
             langs_list = None
         return {"input_ids": inputs_list, "attention_mask": attns_list, "langs": langs_list}
 
+    @classmethod
+    def _load_from_state_dict(cls, state_dict):
+        """Pack separate `q_lin`/`k_lin`/`v_lin` checkpoint entries into the fused `qkv_lin` projection."""
+        for key in [k for k in state_dict if k.endswith(("q_lin.weight", "q_lin.bias"))]:
+            prefix, suffix = key.rsplit("q_lin.", 1)
+            names = [f"{prefix}{proj}.{suffix}" for proj in ("q_lin", "k_lin", "v_lin")]
+            if not all(name in state_dict for name in names):
+                continue
+            packed_name = f"{prefix}qkv_lin.{suffix}"
+            packed = ops.cat([state_dict.pop(name) for name in names], axis=0)
+            state_dict[packed_name] = Parameter(packed, name=packed_name)
+        return state_dict
+
+    @classmethod
+    def _save_to_state_dict(cls, state_dict):
+        """Split the fused `qkv_lin` projection back into `q_lin`/`k_lin`/`v_lin`, the layout of XLM checkpoints."""
+        state_dict = dict(state_dict)
+        for key in [k for k in state_dict if k.endswith(("qkv_lin.weight", "qkv_lin.bias"))]:
+            prefix, suffix = key.rsplit("qkv_lin.", 1)
+            for proj, value in zip(("q_lin", "k_lin", "v_lin"), ops.chunk(state_dict.pop(key), 3, axis=0)):
+                name = f"{prefix}{proj}.{suffix}"
+                state_dict[name] = Parameter(value, name=name)
+        return state_dict
+
     def _init_weights(self, cell):
         """Initialize the weights."""
         if isinstance(cell, nn.Embedding):
@@ -311,6 +521,7 @@ class XLMModel(XLMPreTrainedModel):
         # dictionary / languages
         self.n_langs = config.n_langs
         self.use_lang_emb = config.use_lang_emb
+        self._use_langs = bool(config.use_lang_emb and config.n_langs > 1)
         self.n_words = config.n_words
         self.eos_index = config.eos_index
         self.pad_index = config.pad_index
@@ -333,7 +544,7 @@ class XLMModel(XLMPreTrainedModel):
         self.position_embeddings = nn.Embedding(config.max_position_embeddings, self.dim)
         if config.sinusoidal_embeddings:
             create_sinusoidal_embeddings(config.max_position_embeddings, self.dim, out=self.position_embeddings.weight)
-        if config.n_langs > 1 and config.use_lang_emb:
+        if self._use_langs:
             self.lang_embeddings = nn.Embedding(self.n_langs, self.dim)
         self.embeddings = nn.Embedding(self.n_words, self.dim, padding_idx=self.pad_index)
         self.layer_norm_emb = nn.LayerNorm([self.dim], epsilon=config.layer_norm_eps)
@@ -360,6 +571,9 @@ class XLMModel(XLMPreTrainedModel):
         self.layer_norm1 = nn.CellList(layer_norm1)
         self.ffns = nn.CellList(ffns)
         self.layer_norm2 = nn.CellList(layer_norm2)
+        # attention entry points resolved once, so the layer loop neither branches nor unpacks tuples per layer
+        self._attn_fns = [attn._forward_attn_only for attn in self.attentions]
+        self._attn_fns_with_weights = [attn._forward_attn_with_weights for attn in self.attentions]
 
         if hasattr(config, "pruned_heads"):
             pruned_heads = config.pruned_heads.copy().items()
@@ -370,7 +584,6 @@ class XLMModel(XLMPreTrainedModel):
 
         # Initialize weights and apply final processing
         self.post_init()
-        self.position_ids = ops.arange(config.max_position_embeddings).broadcast_to((1, -1))
 
     def get_input_embeddings(self):
         return self.embeddings
@@ -386,6 +599,16 @@ class XLMModel(XLMPreTrainedModel):
         for layer, heads in heads_to_prune.items():
             self.attentions[layer].prune_heads(heads)
 
+    def _embed(self, inputs_embeds, position_ids, langs, token_type_ids, mask_f):
+        """Embedding output: token, position and optional language/token type embeddings, normalized and masked."""
+        tensor = inputs_embeds + self.position_embeddings(position_ids)  # (1 or bs, slen, dim) broadcasts over bs
+        if self._use_langs and langs is not None:
+            tensor = tensor + self.lang_embeddings(langs)
+        if token_type_ids is not None:
+            tensor = tensor + self.embeddings(token_type_ids)
+        # dropout is elementwise, so applying it after the padding mask gives the same result
+        return ops.dropout(self.layer_norm_emb(tensor) * mask_f, p=self.dropout, training=self.training)
+
     def construct(
         self,
         input_ids: Optional[mindspore.Tensor] = None,
@@ -435,7 +658,7 @@ class XLMModel(XLMPreTrainedModel):
 
         # position_ids
         if position_ids is None:
-            position_ids = self.position_ids[:, :slen]
+            position_ids = ops.arange(slen, dtype=mindspore.int64)[None, :]
         else:
             assert position_ids.shape == (bs, slen)  # (slen, bs)
             # position_ids = position_ids.swapaxes(0, 1)
@@ -458,37 +681,34 @@ class XLMModel(XLMPreTrainedModel):
             mask = mask[:, -_slen:]
             attn_mask = attn_mask[:, -_slen:]
 
+        # additive attention mask, a quarter of the float32 minimum so that adding it twice cannot overflow to -inf
+        attn_mask_add = (1.0 - attn_mask.astype(mindspore.float32)) * float(np.finfo(np.float32).min / 4)
+
         # embeddings
         if inputs_embeds is None:
             inputs_embeds = self.embeddings(input_ids)
 
-        tensor = inputs_embeds + self.position_embeddings(position_ids).expand_as(inputs_embeds)
-        if langs is not None and self.use_lang_emb and self.n_langs > 1:
-            tensor = tensor + self.lang_embeddings(langs)
-        if token_type_ids is not None:
-            tensor = tensor + self.embeddings(token_type_ids)
-        tensor = self.layer_norm_emb(tensor)
-        tensor = ops.dropout(tensor, p=self.dropout, training=self.training)
-        tensor *= mask.unsqueeze(-1).to(tensor.dtype)
+        mask_f = mask.unsqueeze(-1).astype(inputs_embeds.dtype)  # (bs, slen, 1)
+        tensor = self._embed(inputs_embeds, position_ids, langs, token_type_ids, mask_f)
 
         # transformer layers
-        hidden_states = () if output_hidden_states else None
-        attentions = () if output_attentions else None
+        hidden_states = [] if output_hidden_states else None
+        attentions = [] if output_attentions else None
+        attn_fns = self._attn_fns_with_weights if output_attentions else self._attn_fns
+        # Padded keys are excluded by the attention mask, so padded rows cannot leak into real positions and masking
+        # once after the stack is enough. The causal mask ignores the padding mask though, so with an explicit
+        # (e.g. left) padding mask real positions may attend to padded ones, which must then stay zeroed per layer,
+        # as must intermediate hidden states that are returned.
+        remask_per_layer = (self.causal and attention_mask is not None) or output_hidden_states
         for i in range(self.n_layers):
             if output_hidden_states:
-                hidden_states = hidden_states + (tensor,)
+                hidden_states.append(tensor)
 
             # self attention
-            attn_outputs = self.attentions[i](
-                tensor,
-                attn_mask,
-                cache=cache,
-                head_mask=head_mask[i],
-                output_attentions=output_attentions,
-            )
-            attn = attn_outputs[0]
+            attn = attn_fns[i](tensor, attn_mask_add, cache=cache, head_mask=head_mask[i])
             if output_attentions:
-                attentions = attentions + (attn_outputs[1],)
+                attn, weights = attn
+                attentions.append(weights)
             attn = ops.dropout(attn, p=self.dropout, training=self.training)
             tensor = tensor + attn
             tensor = self.layer_norm1[i](tensor)
@@ -503,11 +723,15 @@ class XLMModel(XLMPreTrainedModel):
             # FFN
             tensor = tensor + self.ffns[i](tensor)
             tensor = self.layer_norm2[i](tensor)
-            tensor *= mask.unsqueeze(-1).to(tensor.dtype)
+            if remask_per_layer:
+                tensor *= mask_f
+
+        if not remask_per_layer:
+            tensor *= mask_f
 
         # Add last hidden state
         if output_hidden_states:
-            hidden_states = hidden_states + (tensor,)
+            hidden_states.append(tensor)
 
         # update cache length
         if cache is not None:
@@ -516,6 +740,11 @@ class XLMModel(XLMPreTrainedModel):
         # move back sequence length to dimension 0
         # tensor = tensor.swapaxes(0, 1)
 
+        if output_hidden_states:
+            hidden_states = tuple(hidden_states)
+        if output_attentions:
+            attentions = tuple(attentions)
+
         if not return_dict:
             return tuple(v for v in [tensor, hidden_states, attentions] if v is not None)
         return BaseModelOutput(last_hidden_state=tensor, hidden_states=hidden_states, attentions=attentions)
@@ -18,6 +18,7 @@
 
 import inspect
 
+import numpy as np
 import mindspore
 from mindspore import nn, ops, Parameter
 from mindspore.common.initializer import initializer, Normal
@@ -94,15 +95,15 @@ def find_pruneable_heads_and_indices(heads, n_heads, head_size, already_pruned_h
     Returns:
         `Tuple[Set[int], MindSpore.Tensor[int64]]`: A tuple with the remaining heads and their corresponding indices.
     """
-    mask = ops.ones((n_heads, head_size))
     heads = set(heads) - already_pruned_heads  # Convert to set and remove already pruned heads
-    for head in heads:
-        # Compute how many pruned heads are before the head and move the index accordingly
-        head = head - sum(1 if h < head else 0 for h in already_pruned_heads)
-        mask[head] = 0
-    mask = mask.view(-1).eq(1)
-    index = ops.arange(len(mask), dtype=mindspore.int64)[mask]
-    return heads, index
+    heads_arr = np.fromiter(heads, dtype=np.int64, count=len(heads))
+    pruned_arr = np.fromiter(already_pruned_heads, dtype=np.int64, count=len(already_pruned_heads))
+    # Compute how many pruned heads are before each head and move the index accordingly
+    shifted = heads_arr - (pruned_arr[None, :] < heads_arr[:, None]).sum(axis=1)
+    keep = np.ones(n_heads, dtype=bool)
+    keep[shifted] = False
+    index = np.arange(n_heads * head_size, dtype=np.int64).reshape(n_heads, head_size)[keep].reshape(-1)
+    return heads, mindspore.Tensor(index, mindspore.int64)
 
 def prune_linear_layer(layer, index, axis=0):
     """
@@ -115,22 +116,23 @@ def prune_linear_layer(layer, index, axis=0):
     Returns:
         `mindspore.nn.Dense`: The pruned layer as a new layer with `requires_grad=True`.
     """
-    W = layer.weight.index_select(axis, index).copy()
-    if layer.bias is not None:
-        if axis == 1:
-            b = layer.bias.copy()
-        else:
-            b = layer.bias[index].copy()
-    new_size = list(layer.weight.shape)
-    new_size[axis] = len(index)
-    new_layer = nn.Dense(new_size[1], new_size[0], has_bias=layer.bias is not None)
-    new_layer.weight.requires_grad = False
+    b = None
+    if layer.weight.dtype in (mindspore.float16, mindspore.float32, mindspore.float64):
+        # gather on the host and copy each pruned parameter to the device once
+        index = index.asnumpy()
+        W = mindspore.Tensor(layer.weight.asnumpy().take(index, axis=axis), layer.weight.dtype)
+        if layer.bias is not None:
+            b = layer.bias.asnumpy()
+            b = mindspore.Tensor(b.take(index) if axis == 0 else b, layer.bias.dtype)
+    else:
+        # numpy cannot represent the dtype (e.g. bfloat16), gather on the device
+        W = layer.weight.index_select(axis, index).copy()
+        if layer.bias is not None:
+            b = layer.bias[index].copy() if axis == 0 else layer.bias.copy()
+    new_layer = nn.Dense(W.shape[1], W.shape[0], has_bias=layer.bias is not None, dtype=layer.weight.dtype)
     new_layer.weight.set_data(W)
-    new_layer.weight.requires_grad = True
-    if layer.bias is not None:
-        new_layer.bias.requires_grad = False
+    if b is not None:
         new_layer.bias.set_data(b)
-        new_layer.bias.requires_grad = True
     return new_layer
 
 
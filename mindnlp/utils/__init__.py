@@ -23,7 +23,7 @@ from .compatibility import *
 from .import_utils import requires_backends, is_mindspore_available, OptionalDependencyNotAvailable, is_sentencepiece_available, \
 is_tokenizers_available, direct_transformers_import, is_protobuf_available, is_safetensors_available, \
 is_cython_available, is_pretty_midi_available, is_essentia_available, is_librosa_available, is_scipy_available, is_pyctcdecode_available, \
-is_jieba_available
+is_jieba_available, is_numba_available
 
 from .testing_utils import require_mindspore
 from .save import convert_file_size_to_int
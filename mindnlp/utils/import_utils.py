@@ -75,6 +75,7 @@ _mindspore_version, _mindspore_available = _is_package_available(
 
 _librosa_available = _is_package_available("librosa")
 _scipy_available = _is_package_available("scipy")
+_numba_available = _is_package_available("numba")
 
 _pretty_midi_available = importlib.util.find_spec("pretty_midi") is not None
 try:
@@ -144,6 +145,9 @@ def is_scipy_available():
 def is_jieba_available():
     return _jieba_available
 
+def is_numba_available():
+    return _numba_available
+
 def is_in_notebook():
     try:
         # Test adapted from tqdm.autonotebook: https://github.com/tqdm/tqdm/blob/master/tqdm/autonotebook.py
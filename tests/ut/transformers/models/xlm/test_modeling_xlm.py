@@ -13,8 +13,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import tempfile
+
+import numpy as np
+
 from mindnlp.transformers import XLMConfig
-from mindnlp.utils import is_mindspore_available
+from mindnlp.utils import is_mindspore_available, is_numba_available
 from mindnlp.utils.testing_utils import require_mindspore, slow
 
 from ...generation.test_utils import GenerationTesterMixin
@@ -35,7 +40,15 @@ if is_mindspore_available():
         XLMModel,
         XLMWithLMHeadModel,
     )
-    from mindnlp.transformers.models.xlm.modeling_xlm import XLM_PRETRAINED_MODEL_ARCHIVE_LIST
+    from mindnlp.transformers.models.xlm.modeling_xlm import (
+        XLM_PRETRAINED_MODEL_ARCHIVE_LIST,
+        TransformerFFN,
+        _flash_attention,
+        _numba_sincos_pe,
+        _topk_attention,
+        create_sinusoidal_embeddings,
+        get_masks,
+    )
 
 
 class XLMModelTester:
@@ -358,6 +371,13 @@ class XLMModelTester:
         return config, inputs_dict
 
 
+def _eval_model(parent, **kwargs):
+    """Small `XLMModel` in evaluation mode, configured by `XLMModelTester`."""
+    model = XLMModel(XLMModelTester(parent, **kwargs).get_config())
+    model.set_train(False)
+    return model
+
+
 class XLMModelTest(ModelTesterMixin, GenerationTesterMixin, MindNLPTestCase):
     all_model_classes = (
         (
@@ -537,3 +557,180 @@ class XLMModelLanguageGenerationTest(MindNLPTestCase):
         # TODO(PVP): this and other input_ids I tried for generation give pretty bad results. Not sure why. Model might just not be made for auto-regressive inference
         output_ids = model.generate(input_ids, do_sample=False)
         self.assertListEqual(output_ids[0].asnumpy().tolist(), expected_output_ids)
+
+
+@require_mindspore
+class XLMAttentionPathsTest(MindNLPTestCase):
+    def _qkv(self, bs=2, n_heads=2, slen=10, dim_per_head=4):
+        rng = np.random.default_rng(0)
+        return tuple(
+            mindspore.Tensor(rng.standard_normal((bs, n_heads, slen, dim_per_head)), mindspore.float32)
+            for _ in range(3)
+        )
+
+    def _mask_add(self, slen, causal):
+        lengths = mindspore.Tensor([slen, slen - 4], mindspore.int64)
+        _, attn_mask = get_masks(slen, lengths, causal)
+        return (1.0 - attn_mask.astype(mindspore.float32)) * float(np.finfo(np.float32).min / 4)
+
+    def _dense_attention(self, q, k, v, mask_add):
+        mask_add = mask_add[:, None] if mask_add.ndim == 3 else mask_add[:, None, None, :]
+        weights = ops.softmax(ops.matmul(q, k.swapaxes(2, 3)) + mask_add, axis=-1)
+        return ops.matmul(weights, v)
+
+    def test_get_masks(self):
+        lengths = mindspore.Tensor([5, 3], mindspore.int64)
+        mask, attn_mask = get_masks(5, lengths, causal=False)
+        self.assertEqual(mask.shape, (2, 5))
+        np.testing.assert_array_equal(attn_mask.asnumpy(), mask.asnumpy())
+
+        # the causal mask is shared by the whole batch
+        mask, attn_mask = get_masks(5, lengths, causal=True)
+        self.assertEqual(mask.shape, (2, 5))
+        self.assertEqual(attn_mask.shape, (1, 5, 5))
+        np.testing.assert_array_equal(attn_mask.asnumpy()[0], np.tril(np.ones((5, 5), dtype=bool)))
+
+    def test_flash_attention_matches_dense(self):
+        q, k, v = self._qkv()
+        for causal in (False, True):
+            mask_add = self._mask_add(q.shape[2], causal)
+            expected = self._dense_attention(q, k, v, mask_add)
+            result = _flash_attention(q, k, v, mask_add, block_size=4)
+            self.assertEqual(result.dtype, v.dtype)
+            np.testing.assert_allclose(result.asnumpy(), expected.asnumpy(), atol=1e-5)
+
+    def test_topk_attention_with_all_keys_matches_dense(self):
+        q, k, v = self._qkv()
+        for causal in (False, True):
+            mask_add = self._mask_add(q.shape[2], causal)
+            expected = self._dense_attention(q, k, v, mask_add)
+            result = _topk_attention(q, k, v, mask_add, top_k=k.shape[2], chunk_size=4)
+            np.testing.assert_allclose(result.asnumpy(), expected.asnumpy(), atol=1e-5)
+
+    def test_reduced_attention_dtype_paths(self):
+        q, k, v = self._qkv()
+        mask_add = self._mask_add(q.shape[2], causal=True)
+        expected = self._dense_attention(q, k, v, mask_add).asnumpy()
+        q16, k16, v16 = (x.astype(mindspore.float16) for x in (q, k, v))
+        for result in (
+            _flash_attention(q16, k16, v16, mask_add, block_size=4),
+            _topk_attention(q16, k16, v16, mask_add, top_k=k.shape[2], chunk_size=4),
+        ):
+            self.assertEqual(result.dtype, mindspore.float16)
+            np.testing.assert_allclose(result.asnumpy().astype(np.float32), expected, atol=1e-2)
+
+    def test_attention_dtype_is_validated(self):
+        self.assertEqual(XLMConfig(attention_dtype="bfloat16").attention_dtype, "bfloat16")
+        with self.assertRaises(ValueError):
+            XLMConfig(attention_dtype="float32")
+
+
+@require_mindspore
+class XLMCheckpointLayoutTest(MindNLPTestCase):
+    def test_save_pretrained_writes_separate_qkv(self):
+        model = _eval_model(self)
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            model.save_pretrained(tmpdirname)
+            keys = mindspore.load_checkpoint(os.path.join(tmpdirname, "mindspore.ckpt")).keys()
+        self.assertFalse(any("qkv_lin" in key for key in keys))
+        for proj in ("q_lin", "k_lin", "v_lin"):
+            self.assertIn(f"attentions.0.{proj}.weight", keys)
+            self.assertIn(f"attentions.0.{proj}.bias", keys)
+
+    def test_load_separate_qkv_state_dict(self):
+        model = _eval_model(self)
+        state_dict = model._save_to_state_dict(model.parameters_dict())
+        self.assertIn("attentions.1.q_lin.weight", state_dict)
+
+        loaded = XLMModel._load_from_state_dict(state_dict)
+        np.testing.assert_array_equal(
+            loaded["attentions.1.qkv_lin.weight"].asnumpy(), model.attentions[1].qkv_lin.weight.asnumpy()
+        )
+        self.assertNotIn("attentions.1.q_lin.weight", loaded)
+
+    def test_sharded_round_trip(self):
+        model = _eval_model(self)
+        input_ids = mindspore.Tensor([[5, 6, 7, 8, 9]], mindspore.int64)
+        expected = model(input_ids)[0]
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            # small enough that the q/k/v projections of a layer end up in different shards
+            model.save_pretrained(tmpdirname, max_shard_size="6KB")
+            self.assertTrue(os.path.isfile(os.path.join(tmpdirname, "mindspore.ckpt.index.json")))
+            new_model, loading_info = XLMModel.from_pretrained(tmpdirname, output_loading_info=True)
+        self.assertEqual(loading_info["missing_keys"], [])
+        self.assertEqual(loading_info["unexpected_keys"], [])
+        new_model.set_train(False)
+        np.testing.assert_allclose(new_model(input_ids)[0].asnumpy(), expected.asnumpy(), atol=1e-5)
+
+
+@require_mindspore
+class XLMIncrementalDecodingTest(MindNLPTestCase):
+    def test_cached_decoding_matches_full_forward(self):
+        model = _eval_model(self, causal=True)
+        input_ids = mindspore.Tensor(np.arange(5, 23).reshape(2, 9), mindspore.int64)
+        expected = model(input_ids)[0].asnumpy()
+
+        # a prompt followed by token by token steps, which also grows the cache buffers
+        cache = {"slen": 0}
+        outputs = [model(input_ids[:, :3], cache=cache)[0]]
+        for end in range(4, input_ids.shape[1] + 1):
+            outputs.append(model(input_ids[:, :end], cache=cache)[0])
+        result = ops.cat(outputs, axis=1).asnumpy()
+
+        self.assertEqual(cache["slen"], input_ids.shape[1])
+        np.testing.assert_allclose(result, expected, atol=1e-5)
+
+    def test_cache_longer_than_max_position_embeddings(self):
+        model = _eval_model(self, causal=True, max_position_embeddings=4)
+        cache = {"slen": 0}
+        model(mindspore.Tensor([[5, 6, 7, 8]], mindspore.int64), cache=cache)
+        with self.assertRaises(ValueError):
+            model.attentions[0](
+                ops.zeros((1, 1, 32), mindspore.float32), ops.zeros((1, 1, 5), mindspore.float32), cache=cache
+            )
+
+
+@require_mindspore
+class XLMChunkedFeedForwardTest(MindNLPTestCase):
+    def test_chunked_matches_unchunked(self):
+        config = XLMConfig(emb_dim=16, dropout=0.0, chunk_size_feed_forward=3)
+        ffn = TransformerFFN(16, 64, 16, config=config)
+        inputs = mindspore.Tensor(np.random.default_rng(0).standard_normal((2, 8, 16)), mindspore.float32)
+
+        def forward(chunk_size):
+            ffn.chunk_size_feed_forward = chunk_size
+            grad_fn = mindspore.value_and_grad(lambda x: ffn(x).sum(), None, ffn.trainable_params())
+            return ffn(inputs), grad_fn(inputs)[1]
+
+        expected, expected_grads = forward(0)
+        result, grads = forward(3)
+        np.testing.assert_allclose(result.asnumpy(), expected.asnumpy(), atol=1e-5)
+        for grad, expected_grad in zip(grads, expected_grads):
+            np.testing.assert_allclose(grad.asnumpy(), expected_grad.asnumpy(), atol=1e-5)
+
+
+@require_mindspore
+class XLMSinusoidalEmbeddingsTest(MindNLPTestCase):
+    def _table(self, n_pos, dim):
+        out = mindspore.Parameter(ops.zeros((n_pos, dim), mindspore.float32), name="position_embeddings")
+        create_sinusoidal_embeddings(n_pos, dim, out=out)
+        return out.asnumpy()
+
+    def test_table_matches_reference_formula(self):
+        for dim in (32, 33):
+            position_enc = np.array(
+                [[pos / np.power(10000, 2 * (j // 2) / dim) for j in range(dim)] for pos in range(64)]
+            )
+            expected = np.empty((64, dim))
+            expected[:, 0::2] = np.sin(position_enc[:, 0::2])
+            expected[:, 1::2] = np.cos(position_enc[:, 1::2])
+            np.testing.assert_allclose(self._table(64, dim), expected, rtol=0, atol=1e-6)
+
+    def test_numba_table_matches_numpy(self):
+        if not is_numba_available():
+            self.skipTest("numba is not installed")
+        for dim in (32, 33):
+            div_term = np.exp(np.arange(0, dim, 2, dtype=np.float64) * (-np.log(10000.0) / dim))
+            out = np.empty((64, dim), dtype=np.float32)
+            _numba_sincos_pe()(div_term, out)
+            np.testing.assert_allclose(out, self._table(64, dim), rtol=0, atol=1e-6)
@@ -0,0 +1,96 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Test MindSpore utils"""
+import numpy as np
+
+from mindnlp.utils import is_mindspore_available
+from mindnlp.utils.testing_utils import require_mindspore
+
+from ...common import MindNLPTestCase
+
+if is_mindspore_available():
+    import mindspore
+    from mindspore import nn
+
+    from mindnlp.transformers.ms_utils import find_pruneable_heads_and_indices, prune_linear_layer
+
+
+def _find_pruneable_heads_and_indices_loop(heads, n_heads, head_size, already_pruned_heads):
+    """Reference implementation masking one head at a time."""
+    mask = np.ones((n_heads, head_size))
+    heads = set(heads) - already_pruned_heads
+    for head in heads:
+        head = head - sum(1 if h < head else 0 for h in already_pruned_heads)
+        mask[head] = 0
+    return heads, np.arange(mask.size)[mask.reshape(-1) == 1]
+
+
+@require_mindspore
+class FindPruneableHeadsTest(MindNLPTestCase):
+    def test_matches_loop(self):
+        cases = [
+            ([0, 2], 4, 3, set()),
+            ([1], 4, 2, {0}),
+            ([0, 3, 5, 5], 4, 2, {1, 4}),
+            ([1, 4], 4, 2, {1, 4}),
+            ([], 3, 2, set()),
+        ]
+        for heads, n_heads, head_size, already_pruned_heads in cases:
+            expected_heads, expected_index = _find_pruneable_heads_and_indices_loop(
+                heads, n_heads, head_size, already_pruned_heads
+            )
+            result_heads, result_index = find_pruneable_heads_and_indices(
+                heads, n_heads, head_size, already_pruned_heads
+            )
+            self.assertEqual(result_heads, expected_heads)
+            self.assertEqual(result_index.dtype, mindspore.int64)
+            np.testing.assert_array_equal(result_index.asnumpy(), expected_index)
+
+
+@require_mindspore
+class PruneLinearLayerTest(MindNLPTestCase):
+    def _check_pruned(self, layer, index, axis):
+        pruned = prune_linear_layer(layer, mindspore.Tensor(index, mindspore.int64), axis=axis)
+        weight = layer.weight.astype(mindspore.float32).asnumpy()
+        bias = layer.bias.astype(mindspore.float32).asnumpy()
+        self.assertEqual(pruned.weight.dtype, layer.weight.dtype)
+        np.testing.assert_array_equal(pruned.weight.astype(mindspore.float32).asnumpy(), weight.take(index, axis=axis))
+        np.testing.assert_array_equal(
+            pruned.bias.astype(mindspore.float32).asnumpy(), bias.take(index) if axis == 0 else bias
+        )
+
+    def _layer(self, dtype):
+        rng = np.random.default_rng(0)
+        layer = nn.Dense(6, 8, dtype=dtype)
+        layer.weight.set_data(mindspore.Tensor(rng.standard_normal((8, 6)), mindspore.float32).astype(dtype))
+        layer.bias.set_data(mindspore.Tensor(rng.standard_normal(8), mindspore.float32).astype(dtype))
+        return layer
+
+    def test_prune_linear_layer(self):
+        layer = nn.Dense(6, 8)
+        for axis in (0, 1):
+            self._check_pruned(layer, np.array([0, 2, 3, 5]), axis)
+
+    def test_prune_linear_layer_float16(self):
+        layer = self._layer(mindspore.float16)
+        for axis in (0, 1):
+            self._check_pruned(layer, np.array([1, 4]), axis)
+
+    def test_prune_linear_layer_bfloat16(self):
+        if not hasattr(mindspore, "bfloat16"):
+            self.skipTest("bfloat16 is not supported by this MindSpore version")
+        layer = self._layer(mindspore.bfloat16)
+        for axis in (0, 1):
+            self._check_pruned(layer, np.array([1, 4]), axis)